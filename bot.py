@@ -3,18 +3,19 @@ import hashlib
 import hmac
 import logging
 import os
-import json
 import random
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
-from urllib.parse import parse_qsl
+from urllib.parse import unquote_to_bytes
 
 import motor.motor_asyncio
 import redis.asyncio as redis
+from pymongo import ReturnDocument
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.types import (
-    InlineKeyboardMarkup, 
-    InlineKeyboardButton, 
+    CallbackQuery,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
     WebAppInfo
 )
 from aiogram.filters import CommandStart, Command
@@ -23,7 +24,9 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.redis import RedisStorage
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import aiohttp
+import orjson
 from quart import Quart, request, jsonify
+from quart.json.provider import DefaultJSONProvider
 
 # Настройки из переменных окружения
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -43,14 +46,60 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON через orjson — быстрее stdlib на мелких payload'ах API"""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
 # Инициализации
 app = Quart(__name__)
+app.json = OrjsonProvider(app)
+
+# Красные номера рулетки — frozenset дает O(1) проверку вместо
+# линейного прохода по списку на каждый спин
+_ROULETTE_REDS = frozenset({1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36})
+
+# Символы слотов и множители за три одинаковых (остальные тройки — x3)
+_SLOT_SYMBOLS = ('🍒', '🍋', '🍉', '⭐', '💎', '7️⃣')
+_SLOT_TRIPLE_MULTIPLIERS = {'7️⃣': 10, '💎': 5}
 
 # FSM состояния
 class Form(StatesGroup):
     deposit = State()
     withdraw_amount = State()
 
+def _build_main_menu() -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="🎰 Играть", web_app=WebAppInfo(url=WEB_APP_URL))
+    keyboard.button(text="💼 Профиль", callback_data="profile")
+    keyboard.button(text="📞 Поддержка", url=f"https://t.me/your_support")
+    keyboard.adjust(1, 2)
+    return keyboard.as_markup()
+
+def _build_profile_menu() -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="📥 Пополнить", callback_data="deposit")
+    keyboard.button(text="📤 Вывести", callback_data="withdraw")
+    keyboard.button(text="📊 История", callback_data="history")
+    keyboard.button(text="🔙 Главное меню", callback_data="main")
+    keyboard.adjust(2, 1)
+    return keyboard.as_markup()
+
+def _build_back_keyboard() -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardBuilder()
+    keyboard.button(text="🔙 Назад", callback_data="profile")
+    return keyboard.as_markup()
+
+# Меню статичны — собираем разметку один раз при импорте, а не на
+# каждый callback
+_MAIN_MENU = _build_main_menu()
+_PROFILE_MENU = _build_profile_menu()
+_BACK_KB = _build_back_keyboard()
+
 class CasinoBot:
     def __init__(self):
         self.bot = Bot(token=BOT_TOKEN)
@@ -60,6 +109,20 @@ class CasinoBot:
         self.db: Optional[motor.motor_asyncio.AsyncIOMotorDatabase] = None
         self.session: Optional[aiohttp.ClientSession] = None
         self.app = app
+        # Очередь на batch-запись истории игр (см. _history_flusher)
+        self._hist_queue: asyncio.Queue = asyncio.Queue()
+        # Грубая метка времени, обновляется фоном (см. _clock_refresher)
+        self._now = datetime.utcnow()
+        # Секретный ключ для проверки initData не меняется в рантайме —
+        # считаем его один раз, а не на каждый запрос
+        self._secret_key = hmac.new(
+            b"WebAppData",
+            BOT_TOKEN.encode(),
+            hashlib.sha256
+        ).digest()
+        # Заранее прокинутый ключом HMAC: copy() клонирует уже
+        # инициализированные контексты и экономит блок сжатия на запрос
+        self._hmac_template = hmac.new(self._secret_key, b"", hashlib.sha256)
         
     async def init_db(self):
         """Инициализация MongoDB"""
@@ -69,6 +132,10 @@ class CasinoBot:
         # Создание индексов
         await self.db.users.create_index("user_id", unique=True)
         await self.db.transactions.create_index("invoice_id", unique=True)
+        # Под 24-часовую админскую статистику: $match идет только по
+        # created_at (и по type в $cond), без индекса это COLLSCAN
+        await self.db.transactions.create_index([("created_at", -1)])
+        await self.db.transactions.create_index([("type", 1), ("created_at", -1)])
         await self.db.games_history.create_index([("user_id", 1), ("created_at", -1)])
         
         logger.info("MongoDB initialized")
@@ -77,41 +144,88 @@ class CasinoBot:
         """Инициализация aiohttp сессии"""
         self.session = aiohttp.ClientSession()
 
-    def validate_telegram_data(self, init_data: str) -> bool:
-        """Безопасная валидация данных от Telegram"""
-        try:
-            # Парсим query string в словарь
-            data = dict(parse_qsl(init_data))
-            received_hash = data.pop('hash', '')
-            
-            # Сортируем ключи и формируем строку
-            data_check_string = '\n'.join(sorted([f"{k}={v}" for k, v in data.items()]))
-            
-            secret_key = hmac.new(
-                b"WebAppData", 
-                BOT_TOKEN.encode(), 
-                hashlib.sha256
-            ).digest()
-            
-            calculated_hash = hmac.new(
-                secret_key, 
-                data_check_string.encode(), 
-                hashlib.sha256
-            ).hexdigest()
-            
-            return calculated_hash == received_hash
-        except Exception as e:
-            logger.error(f"Validation error: {e}")
-            return False
+    async def _clock_refresher(self):
+        """Обновляет self._now каждые 500 мс.
+
+        Для полей вида last_active секундной точности достаточно, а так
+        хендлеры не дергают datetime.utcnow() на каждый запрос. Там, где
+        нужна суб-секундная точность (транзакции, история игр), по-прежнему
+        берется свежий utcnow().
+        """
+        while True:
+            self._now = datetime.utcnow()
+            await asyncio.sleep(0.5)
+
+    async def _history_flusher(self):
+        """Фоновая запись истории игр батчами.
+
+        Копит документы из очереди до 100 штук или 50 мс и пишет их одним
+        insert_many(ordered=False) — одна сетевая операция на пачку спинов
+        вместо insert_one на каждый.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._hist_queue.get()]
+            deadline = loop.time() + 0.05
+            while len(batch) < 100:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._hist_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.db.games_history.insert_many(batch, ordered=False)
+            except Exception as e:
+                logger.error(f"History flush error: {e}")
 
-    def extract_user_id(self, init_data: str) -> Optional[int]:
-        """Безопасное извлечение user_id"""
+    async def _notify_admins(self, text: str):
+        """Параллельная рассылка уведомления всем админам"""
+        await asyncio.gather(
+            *(self.bot.send_message(admin_id, text, parse_mode="HTML")
+              for admin_id in ADMIN_IDS),
+            return_exceptions=True
+        )
+
+    def authenticate(self, init_data: str) -> Optional[int]:
+        """Валидация initData от Telegram и извлечение user_id за один проход"""
         try:
-            data = dict(parse_qsl(init_data))
-            user_data = json.loads(data.get('user', '{}'))
-            return user_data.get('id')
+            # initData — всегда одни и те же 6-8 известных ключей, поэтому
+            # вместо универсального parse_qsl хватает split + unquote.
+            # Работаем сразу в байтах: один encode на входе, дальше ни
+            # одной str-аллокации до самой проверки подписи
+            received_hash = b''
+            pairs = []
+            for pair in init_data.encode().split(b'&'):
+                if pair.startswith(b'hash='):
+                    received_hash = pair[5:]
+                else:
+                    pairs.append(unquote_to_bytes(pair) if b'%' in pair else pair)
+
+            # Ключи уникальны, так что сортировка пар "key=value"
+            # эквивалентна сортировке по ключу
+            pairs.sort()
+
+            # Сравниваем сырые 32 байта вместо hex-строк; кривой hex
+            # отбрасывается ещё на fromhex
+            try:
+                received_digest = bytes.fromhex(received_hash.decode())
+            except ValueError:
+                return None
+
+            mac = self._hmac_template.copy()
+            mac.update(b'\n'.join(pairs))
+
+            if not hmac.compare_digest(mac.digest(), received_digest):
+                return None
+
+            # JSON разбираем только после успешной проверки подписи
+            for pair in pairs:
+                if pair.startswith(b'user='):
+                    return orjson.loads(pair[5:]).get('id')
         except Exception as e:
-            logger.error(f"Extract user_id error: {e}")
+            logger.error(f"Authentication error: {e}")
         return None
 
     # Web_app API endpoints
@@ -120,35 +234,15 @@ class CasinoBot:
         """Инициализация мини-приложения"""
         data = await request.get_json()
         init_data = data.get('initData')
-        
-        if not init_data or not self.validate_telegram_data(init_data):
-            return jsonify({'error': 'Invalid authentication'}), 403
-        
-        user_id = self.extract_user_id(init_data)
+
+        user_id = self.authenticate(init_data) if init_data else None
         if not user_id:
-            return jsonify({'error': 'Invalid user'}), 400
-        
-        # Обновляем активность
-        await self.db.users.update_one(
-            {"user_id": user_id},
-            {"$set": {"last_active": datetime.utcnow()}}
-        )
-        
-        # Получаем данные пользователя
-        user_data = await self.db.users.find_one({"user_id": user_id})
-        if not user_data:
-            user_data = {
-                "user_id": user_id,
-                "balance": 0.0,
-                "username": f"user_{user_id}",
-                "created_at": datetime.utcnow(),
-                "last_active": datetime.utcnow()
-            }
-            await self.db.users.insert_one(user_data)
-        
+            return jsonify({'error': 'Invalid authentication'}), 403
+
         # Статистика
+        now = self._now
         stats_pipeline = [
-            {"$match": {"user_id": user_id, "created_at": {"$gt": datetime.utcnow() - timedelta(days=7)}}},
+            {"$match": {"user_id": user_id, "created_at": {"$gt": now - timedelta(days=7)}}},
             {"$group": {
                 "_id": None,
                 "games": {"$sum": 1},
@@ -156,8 +250,26 @@ class CasinoBot:
                 "total_win": {"$sum": "$win_amount"}
             }}
         ]
-        
-        stats_result = await self.db.games_history.aggregate(stats_pipeline).to_list(1)
+
+        # Апсертим пользователя (активность + создание при первом заходе)
+        # одним вызовом и гоним его параллельно с агрегацией статистики
+        user_data, stats_result = await asyncio.gather(
+            self.db.users.find_one_and_update(
+                {"user_id": user_id},
+                {
+                    "$setOnInsert": {
+                        "balance": 0.0,
+                        "username": f"user_{user_id}",
+                        "created_at": now,
+                    },
+                    "$set": {"last_active": now}
+                },
+                projection={"balance": 1, "username": 1, "_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            ),
+            self.db.games_history.aggregate(stats_pipeline).to_list(1)
+        )
         stats = stats_result[0] if stats_result else {}
         
         return jsonify({
@@ -179,38 +291,37 @@ class CasinoBot:
         game_type = data.get('gameType', 'slots')
         bet_amount = float(data.get('betAmount', 0))
         
-        if not init_data or not self.validate_telegram_data(init_data):
-            return jsonify({'error': 'Invalid authentication'}), 403
-        
-        user_id = self.extract_user_id(init_data)
+        user_id = self.authenticate(init_data) if init_data else None
         if not user_id:
-            return jsonify({'error': 'Invalid user'}), 400
-        
+            return jsonify({'error': 'Invalid authentication'}), 403
+
         if not (0.1 <= bet_amount <= MAX_BET):
             return jsonify({'error': 'Invalid bet amount'}), 400
         
-        # Проверяем баланс и списываем ставку
-        user = await self.db.users.find_one({"user_id": user_id})
-        if not user or user['balance'] < bet_amount:
-            return jsonify({'error': 'Insufficient balance'}), 400
-        
-        # Списываем ставку
-        await self.db.users.update_one(
-            {"user_id": user_id},
-            {"$inc": {"balance": -bet_amount}}
+        # Атомарно проверяем баланс и списываем ставку — фильтр по $gte
+        # исключает гонку между проверкой и списанием
+        user = await self.db.users.find_one_and_update(
+            {"user_id": user_id, "balance": {"$gte": bet_amount}},
+            {"$inc": {"balance": -bet_amount}},
+            projection={"balance": 1},
+            return_document=ReturnDocument.AFTER
         )
-        
+        if user is None:
+            return jsonify({'error': 'Insufficient balance'}), 400
+
         # Игра
-        result = await self.process_game(game_type, bet_amount)
-        
-        # Начисляем выигрыш
-        await self.db.users.update_one(
+        result = self.process_game(game_type, bet_amount)
+
+        # Начисляем выигрыш и сразу получаем новый баланс
+        new_balance_doc = await self.db.users.find_one_and_update(
             {"user_id": user_id},
-            {"$inc": {"balance": result['win_amount']}}
+            {"$inc": {"balance": result['win_amount']}},
+            projection={"balance": 1},
+            return_document=ReturnDocument.AFTER
         )
-        
-        # Логируем игру
-        await self.db.games_history.insert_one({
+
+        # Историю пишет фоновый flusher батчами — из хендлера только put
+        self._hist_queue.put_nowait({
             "user_id": user_id,
             "game_type": game_type,
             "bet_amount": bet_amount,
@@ -218,38 +329,27 @@ class CasinoBot:
             "result": result,
             "created_at": datetime.utcnow()
         })
-        
-        new_balance = await self.db.users.find_one({"user_id": user_id})
-        
+
         return jsonify({
             'success': True,
             'result': result,
-            'new_balance': new_balance['balance']
+            'new_balance': new_balance_doc['balance']
         })
 
-    async def process_game(self, game_type: str, bet_amount: float) -> Dict[str, Any]:
+    def process_game(self, game_type: str, bet_amount: float) -> Dict[str, Any]:
         """Обработка логики игры"""
-        if game_type == 'slots':
-            return await self.slots_game(bet_amount, random)
-        elif game_type == 'roulette':
-            return await self.roulette_game(bet_amount, random)
-        else:
-            return await self.slots_game(bet_amount, random)
-
-    async def slots_game(self, bet_amount: float, random) -> Dict[str, Any]:
+        if game_type == 'roulette':
+            return self.roulette_game(bet_amount)
+        return self.slots_game(bet_amount)
+
+    def slots_game(self, bet_amount: float) -> Dict[str, Any]:
         """Слоты с улучшенной математикой"""
-        symbols = ['🍒', '🍋', '🍉', '⭐', '💎', '7️⃣']
-        reels = [symbols[i] for i in [random.randint(0, len(symbols)-1) for _ in range(3)]]
-        
+        reels = random.choices(_SLOT_SYMBOLS, k=3)
+
         # Расчет выигрыша
         multiplier = 0
         if reels[0] == reels[1] == reels[2]:
-            if reels[0] == '7️⃣':
-                multiplier = 10  # Джекпот
-            elif reels[0] == '💎':
-                multiplier = 5
-            else:
-                multiplier = 3
+            multiplier = _SLOT_TRIPLE_MULTIPLIERS.get(reels[0], 3)
         elif reels[0] == reels[1] or reels[1] == reels[2]:
             multiplier = 1.5
         
@@ -262,11 +362,10 @@ class CasinoBot:
             'is_win': win_amount > bet_amount
         }
 
-    async def roulette_game(self, bet_amount: float, random) -> Dict[str, Any]:
+    def roulette_game(self, bet_amount: float) -> Dict[str, Any]:
         """Рулетка"""
         number = random.randint(0, 36)
-        color = 'red' if number in [1,3,5,7,9,12,14,16,18,19,21,23,25,27,30,32,34,36] else 'black'
-        if number == 0: color = 'green'
+        color = 'green' if number == 0 else ('red' if number in _ROULETTE_REDS else 'black')
         
         is_win = random.random() < 0.48
         multiplier = 2 if is_win else 0
@@ -292,11 +391,11 @@ class CasinoBot:
                     "$setOnInsert": {
                         "user_id": message.from_user.id,
                         "balance": 0.0,
-                        "created_at": datetime.utcnow(),
+                        "created_at": self._now,
                     },
                     "$set": {
                         "username": message.from_user.username,
-                        "last_active": datetime.utcnow()
+                        "last_active": self._now
                     }
                 },
                 upsert=True
@@ -317,16 +416,17 @@ class CasinoBot:
                 parse_mode="HTML"
             )
 
-        @self.dp.callback_query(F.data == "main")
-        async def back_main(callback: CallbackQuery):
+        async def back_main(callback: CallbackQuery, state: FSMContext):
             await callback.message.edit_text(
                 "Главное меню",
                 reply_markup=self.main_menu()
             )
 
-        @self.dp.callback_query(F.data == "profile")
-        async def profile(callback: CallbackQuery):
-            user_data = await self.db.users.find_one({"user_id": callback.from_user.id})
+        async def profile(callback: CallbackQuery, state: FSMContext):
+            user_data = await self.db.users.find_one(
+                {"user_id": callback.from_user.id},
+                {"balance": 1, "created_at": 1, "_id": 0}
+            )
             
             # Статистика
             stats_pipeline = [
@@ -357,7 +457,6 @@ class CasinoBot:
                 parse_mode="HTML"
             )
 
-        @self.dp.callback_query(F.data == "deposit")
         async def deposit(callback: CallbackQuery, state: FSMContext):
             await callback.message.edit_text(
                 "💳 <b>Пополнение баланса</b>\n\n"
@@ -435,8 +534,7 @@ class CasinoBot:
             finally:
                 await state.clear()
 
-        @self.dp.callback_query(F.data.startswith("check_dep_"))
-        async def check_deposit(callback: CallbackQuery):
+        async def check_deposit(callback: CallbackQuery, state: FSMContext):
             invoice_id = callback.data.split("_")[2]
             
             async with self.session.get(
@@ -450,38 +548,45 @@ class CasinoBot:
                 
                 if invoice["status"] == "paid":
                     amount = float(invoice["amount"])
-                    
-                    # Проверяем, не обработан ли уже
-                    exists = await self.db.transactions.find_one({
-                        "invoice_id": invoice_id,
-                        "status": "completed"
-                    })
-                    
-                    if not exists:
-                        # Обновляем баланс
-                        await self.db.users.update_one(
-                            {"user_id": callback.from_user.id},
-                            {"$inc": {"balance": amount}}
-                        )
-                        
-                        # Обновляем статус транзакции
-                        await self.db.transactions.update_one(
-                            {"invoice_id": invoice_id},
-                            {"$set": {"status": "completed"}}
-                        )
-                        
-                        # Уведомление админу
-                        for admin_id in ADMIN_IDS:
-                            try:
-                                await self.bot.send_message(
-                                    admin_id,
+
+                    # Redis SETNX — первая линия идемпотентности: гасит
+                    # повторные клики по «Проверить» без похода в Mongo и
+                    # закрывает гонку двойного зачисления между кликами
+                    claimed = await self.redis.set(
+                        f"inv:processed:{invoice_id}", "1", ex=3600, nx=True
+                    )
+                    if claimed:
+                        try:
+                            # Mongo — вторая линия (на случай истекшего TTL)
+                            exists = await self.db.transactions.find_one(
+                                {"invoice_id": invoice_id, "status": "completed"},
+                                {"_id": 1}
+                            )
+
+                            if not exists:
+                                # Обновляем баланс
+                                await self.db.users.update_one(
+                                    {"user_id": callback.from_user.id},
+                                    {"$inc": {"balance": amount}}
+                                )
+
+                                # Обновляем статус транзакции
+                                await self.db.transactions.update_one(
+                                    {"invoice_id": invoice_id},
+                                    {"$set": {"status": "completed"}}
+                                )
+
+                                # Уведомление админам — в фоне, не задерживаем ответ
+                                asyncio.create_task(self._notify_admins(
                                     f"💰 <b>Новый депозит</b>\n\n"
                                     f"User: @{callback.from_user.username}\n"
-                                    f"Amount: <code>{amount} USDT</code>",
-                                    parse_mode="HTML"
-                                )
-                            except:
-                                pass
+                                    f"Amount: <code>{amount} USDT</code>"
+                                ))
+                        except Exception:
+                            # Зачисление не прошло — отпускаем ключ, чтобы
+                            # повторная проверка могла его довести
+                            await self.redis.delete(f"inv:processed:{invoice_id}")
+                            raise
                     
                     await callback.message.edit_text(
                         f"✅ <b>Пополнение успешно!</b>\n\n"
@@ -494,9 +599,11 @@ class CasinoBot:
             else:
                 await callback.answer("❌ Ошибка проверки", show_alert=True)
 
-        @self.dp.callback_query(F.data == "withdraw")
         async def withdraw(callback: CallbackQuery, state: FSMContext):
-            user_data = await self.db.users.find_one({"user_id": callback.from_user.id})
+            user_data = await self.db.users.find_one(
+                {"user_id": callback.from_user.id},
+                {"balance": 1, "_id": 0}
+            )
             
             await callback.message.edit_text(
                 f"📤 <b>Вывод средств</b>\n\n"
@@ -515,7 +622,10 @@ class CasinoBot:
                 user_id = message.from_user.id
                 
                 # Получаем актуальный баланс
-                user_data = await self.db.users.find_one({"user_id": user_id})
+                user_data = await self.db.users.find_one(
+                    {"user_id": user_id},
+                    {"balance": 1, "_id": 0}
+                )
                 
                 if amount < MIN_WITHDRAW:
                     await message.answer(
@@ -572,19 +682,13 @@ class CasinoBot:
                         reply_markup=self.back_keyboard()
                     )
                     
-                    # Уведомление админу
-                    for admin_id in ADMIN_IDS:
-                        try:
-                            await self.bot.send_message(
-                                admin_id,
-                                f"📤 <b>Новый вывод</b>\n\n"
-                                f"User: @{message.from_user.username}\n"
-                                f"Amount: <code>{amount} USDT</code>\n"
-                                f"Check ID: <code>{check['check_id']}</code>",
-                                parse_mode="HTML"
-                            )
-                        except:
-                            pass
+                    # Уведомление админам — в фоне, не задерживаем ответ
+                    asyncio.create_task(self._notify_admins(
+                        f"📤 <b>Новый вывод</b>\n\n"
+                        f"User: @{message.from_user.username}\n"
+                        f"Amount: <code>{amount} USDT</code>\n"
+                        f"Check ID: <code>{check['check_id']}</code>"
+                    ))
                 else:
                     await message.answer(
                         "❌ Ошибка создания чека. Попробуйте позже.",
@@ -598,6 +702,25 @@ class CasinoBot:
             finally:
                 await state.clear()
 
+        # Единая диспетчеризация callback'ов по первому сегменту data:
+        # один хендлер и O(1) lookup вместо прогона каждого callback
+        # через цепочку magic-фильтров
+        callback_table = {
+            "main": back_main,
+            "profile": profile,
+            "deposit": deposit,
+            "withdraw": withdraw,
+            "check": check_deposit,  # check_dep_<invoice_id>
+        }
+
+        @self.dp.callback_query()
+        async def dispatch_callback(callback: CallbackQuery, state: FSMContext):
+            handler = callback_table.get(callback.data.split("_", 1)[0])
+            if handler is not None:
+                await handler(callback, state)
+            else:
+                await callback.answer()
+
         @self.dp.message(Command("stats"))
         async def stats(message: types.Message):
             if message.from_user.id not in ADMIN_IDS:
@@ -606,12 +729,22 @@ class CasinoBot:
             # Агрегация статистики за 24 часа
             pipeline = [
                 {"$match": {"created_at": {"$gte": datetime.utcnow() - timedelta(hours=24)}}},
+                {"$project": {"user_id": 1, "type": 1, "amount": 1, "_id": 0}},
+                # Сначала группируем по пользователю, потом схлопываем в
+                # один документ — без $addToSet сервер не собирает в памяти
+                # массив всех user_id и не гонит его по сети
                 {"$group": {
-                    "_id": None,
-                    "users": {"$addToSet": "$user_id"},
+                    "_id": "$user_id",
                     "deposits": {"$sum": {"$cond": [{"$eq": ["$type", "deposit"]}, "$amount", 0]}},
                     "withdraws": {"$sum": {"$cond": [{"$eq": ["$type", "withdraw"]}, "$amount", 0]}},
                     "transactions": {"$sum": 1}
+                }},
+                {"$group": {
+                    "_id": None,
+                    "users": {"$sum": 1},
+                    "deposits": {"$sum": "$deposits"},
+                    "withdraws": {"$sum": "$withdraws"},
+                    "transactions": {"$sum": "$transactions"}
                 }}
             ]
             
@@ -620,7 +753,7 @@ class CasinoBot:
             
             text = (
                 f"📊 <b>Статистика за 24 часа</b>\n\n"
-                f"👥 Пользователей: {len(stats.get('users', []))}\n"
+                f"👥 Пользователей: {stats.get('users', 0)}\n"
                 f"💰 Депозитов: {stats.get('deposits', 0.0):.2f} USDT\n"
                 f"📤 Выводов: {stats.get('withdraws', 0.0):.2f} USDT\n"
                 f"🔄 Транзакций: {stats.get('transactions', 0)}"
@@ -629,32 +762,21 @@ class CasinoBot:
             await message.answer(text, parse_mode="HTML")
 
     def main_menu(self):
-        keyboard = InlineKeyboardBuilder()
-        keyboard.button(text="🎰 Играть", web_app=WebAppInfo(url=WEB_APP_URL))
-        keyboard.button(text="💼 Профиль", callback_data="profile")
-        keyboard.button(text="📞 Поддержка", url=f"https://t.me/your_support")
-        keyboard.adjust(1, 2)
-        return keyboard.as_markup()
+        return _MAIN_MENU
 
     def profile_menu(self):
-        keyboard = InlineKeyboardBuilder()
-        keyboard.button(text="📥 Пополнить", callback_data="deposit")
-        keyboard.button(text="📤 Вывести", callback_data="withdraw")
-        keyboard.button(text="📊 История", callback_data="history")
-        keyboard.button(text="🔙 Главное меню", callback_data="main")
-        keyboard.adjust(2, 1)
-        return keyboard.as_markup()
+        return _PROFILE_MENU
 
     def back_keyboard(self):
-        keyboard = InlineKeyboardBuilder()
-        keyboard.button(text="🔙 Назад", callback_data="profile")
-        return keyboard.as_markup()
+        return _BACK_KB
 
     async def start(self):
         """Запуск бота и веб-сервера"""
         await self.init_db()
         await self.init_session()
         self.setup_handlers()
+        self._flusher_task = asyncio.create_task(self._history_flusher())
+        self._clock_task = asyncio.create_task(self._clock_refresher())
         
         # Запуск веб-сервера
         port = int(os.getenv("PORT", 5000))
@@ -664,6 +786,12 @@ class CasinoBot:
         
         config = Config()
         config.bind = [f"0.0.0.0:{port}"]
+        # Тюнинг под конкурентный трафик WebApp: очередь accept побольше,
+        # keep-alive дольше дефолтных 5 секунд, чтобы мини-приложение не
+        # переустанавливало соединение между запросами
+        config.backlog = 2048
+        config.keep_alive_timeout = 75
+        config.h11_max_incomplete_size = 16384
         
         await asyncio.gather(
             serve(self.app, config),